@@ -104,7 +104,8 @@ def set_bootstrap_mode():
     disable_fde_autologin()
     # create CHECKANDINSTALLATSTARTUPFLAG file
     try:
-        open(constants.CHECKANDINSTALLATSTARTUPFLAG, 'w').close()
+        os.close(os.open(constants.CHECKANDINSTALLATSTARTUPFLAG,
+                         os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644))
     except (OSError, IOError) as err:
         reset_fde_autologin()
         raise SetupError(
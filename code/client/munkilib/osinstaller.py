@@ -23,7 +23,11 @@ Support for using startosinstall to install macOS.
 from __future__ import absolute_import, print_function
 
 # stdlib imports
+import codecs
+import collections
 import os
+import re
+import select
 import signal
 import subprocess
 import time
@@ -52,6 +56,45 @@ from . import pkgutils
 from . import prefs
 from . import processes
 from . import scriptutils
+from . import wrappers
+
+
+# how much startosinstall output to read at a time
+OUTPUT_READ_SIZE = 8192
+
+# how many lines of startosinstall output to keep for error reporting
+OUTPUT_TAIL_LINES = 4096
+
+# startosinstall output lines that get special handling. The named group
+# that matches identifies the kind of message. Order matters: 'Preparing to '
+# must be tried before the 'Preparing ' percent-complete messages
+STARTOSINSTALL_MSG_RE = re.compile(
+    r'(?P<status>Preparing to )|'
+    r'(?P<percent>Preparing:? )|'
+    r'(?P<legalese>By using the agreetolicense option|If you do not agree,)|'
+    r'(?P<helper_crash>Helper tool cr)|'
+    r'(?P<signaling>Signaling PID:|Waiting to reboot|Process signaled okay)|'
+    r'(?P<going_down>System going down for install)')
+
+
+def append_output_tail(output_tail, line):
+    '''Appends line to output_tail, a deque of recent startosinstall output.
+    If the deque is full, the oldest line is logged before it is dropped so
+    the complete output still ends up in the log'''
+    if len(output_tail) == output_tail.maxlen:
+        munkilog.log('startosinstall: %s' % output_tail[0].rstrip('\n'))
+    output_tail.append(line)
+
+
+def read_plist(filepath):
+    '''Reads a plist with plistlib, which is much lighter than going through
+    PyObjC, falling back to FoundationPlist for anything plistlib can't
+    parse. Raises FoundationPlistException on failure, like
+    FoundationPlist.readPlist'''
+    try:
+        return wrappers.readPlist(filepath)
+    except wrappers.PlistReadError:
+        return FoundationPlist.readPlist(filepath)
 
 
 def boot_volume_is_cs_converting():
@@ -76,12 +119,22 @@ def boot_volume_is_cs_converting():
 def find_install_macos_app(dir_path):
     '''Returns the path to the first Install macOS.app found the top level of
     dir_path, or None'''
-    for item in osutils.listdir(dir_path):
-        item_path = os.path.join(dir_path, item)
-        startosinstall_path = os.path.join(
-            item_path, 'Contents/Resources/startosinstall')
-        if os.path.exists(startosinstall_path):
-            return item_path
+    if not hasattr(find_install_macos_app, 'cache'):
+        find_install_macos_app.cache = {}
+    dir_path = os.path.abspath(dir_path)
+    if dir_path in find_install_macos_app.cache:
+        return find_install_macos_app.cache[dir_path]
+    # scandir gets the file type along with the name, so only directories
+    # (and symlinks, which need a stat to resolve) cost us a stat call
+    with os.scandir(dir_path) as entries:
+        for entry in entries:
+            if not entry.is_dir():
+                continue
+            startosinstall_path = os.path.join(
+                entry.path, 'Contents/Resources/startosinstall')
+            if os.path.exists(startosinstall_path):
+                find_install_macos_app.cache[dir_path] = entry.path
+                return entry.path
     # if we get here we didn't find one
     return None
 
@@ -100,11 +153,25 @@ def install_macos_app_is_stub(app_path):
 
 def get_os_version(app_path):
     '''Returns the os version from the OS Installer app'''
+    if not hasattr(get_os_version, 'cache'):
+        get_os_version.cache = {}
+    app_path = os.path.abspath(app_path)
+    if app_path not in get_os_version.cache:
+        os_version = _get_os_version(app_path)
+        if not os_version:
+            # don't cache failures; the next attempt might succeed
+            return os_version
+        get_os_version.cache[app_path] = os_version
+    return get_os_version.cache[app_path]
+
+
+def _get_os_version(app_path):
+    '''Reads the os version from the OS Installer app'''
     installinfo_plist = os.path.join(
         app_path, 'Contents/SharedSupport/InstallInfo.plist')
     if os.path.isfile(installinfo_plist):
         try:
-            info = FoundationPlist.readPlist(installinfo_plist)
+            info = read_plist(installinfo_plist)
             return info['System Image Info']['version']
         except (FoundationPlist.FoundationPlistException,
                 IOError, KeyError, AttributeError, TypeError):
@@ -121,7 +188,7 @@ def get_os_version(app_path):
                 "com_apple_MobileAsset_MacSoftwareUpdate.xml"
             )
             try:
-                info = FoundationPlist.readPlist(info_plist_path)
+                info = read_plist(info_plist_path)
                 return info['Assets'][0]['OSVersion']
             except FoundationPlist.FoundationPlistException:
                 return ''
@@ -186,6 +253,7 @@ class StartOSInstallRunner(object):
         self.finishing_tasks = finishing_tasks
         self.dmg_mountpoint = None
         self.got_sigusr1 = False
+        self.job_pid = None
 
     def sigusr1_handler(self, _signum, _frame):
         '''Signal handler for SIGUSR1 from startosinstall, which tells us it's
@@ -219,6 +287,24 @@ class StartOSInstallRunner(object):
                 pass
 
         # now tell startosinstall it's OK to proceed
+        self.signal_startosinstall()
+
+    def signal_startosinstall(self):
+        '''Sends SIGUSR1 to startosinstall. startosinstall is run as the child
+        of our launchd job (ptyexec or script), so we can find its pid
+        directly instead of having killall search the process table'''
+        child_pids = None
+        if self.job_pid:
+            child_pids = processes.get_child_pids(self.job_pid)
+        if child_pids:
+            try:
+                for pid in child_pids:
+                    os.kill(pid, signal.SIGUSR1)
+                return
+            except OSError as err:
+                display.display_debug1(
+                    'Could not signal startosinstall: %s', err)
+        # fall back to finding startosinstall by name
         subprocess.call(['/usr/bin/killall', '-SIGUSR1', 'startosinstall'])
 
     def get_app_path(self, itempath):
@@ -250,6 +336,99 @@ class StartOSInstallRunner(object):
                 u'%s doesn\'t appear to be an application or disk image'
                 % itempath)
 
+    def read_output(self, job, timeout):
+        '''Generator that yields lines of startosinstall output as they are
+        written, until startosinstall exits, the user requests a stop, or
+        there has been no output for timeout seconds'''
+        # launchd writes the job's stdout to a regular file. select() always
+        # reports regular files as readable, but a kqueue read filter fires
+        # only when there is data past our current offset
+        stdout_fd = job.stdout.fileno()
+        try:
+            kqueue = select.kqueue()
+            kqueue.control(
+                [select.kevent(stdout_fd, filter=select.KQ_FILTER_READ,
+                               flags=select.KQ_EV_ADD)], 0, 0)
+        except (AttributeError, OSError):
+            # no kqueue support; we'll sleep between checks for output
+            kqueue = None
+
+        # job.returncode() has to ask launchctl, so if we can, have the
+        # kqueue tell us when the job's process exits and only ask then
+        watching_exit = False
+        if kqueue and self.job_pid:
+            try:
+                exit_event = select.kevent(
+                    self.job_pid, filter=select.KQ_FILTER_PROC,
+                    flags=select.KQ_EV_ADD | select.KQ_EV_ONESHOT,
+                    fflags=select.KQ_NOTE_EXIT)
+                kqueue.control([exit_event], 0, 0)
+                watching_exit = True
+            except OSError:
+                # process is already gone, or we can't watch it
+                pass
+        job_exited = False
+
+        # decode output a chunk at a time; the incremental decoder keeps any
+        # multibyte character split across chunks until the rest arrives
+        decoder = codecs.getincrementaldecoder('UTF-8')(errors='replace')
+        partial_line = u''
+        last_output_time = time.monotonic()
+        try:
+            while True:
+                if processes.stop_requested():
+                    job.stop()
+                    break
+
+                data = os.read(stdout_fd, OUTPUT_READ_SIZE)
+                if not data:
+                    if ((job_exited or not watching_exit) and
+                            job.returncode() is not None):
+                        # get anything written just before exiting
+                        data = os.read(stdout_fd, OUTPUT_READ_SIZE)
+                        while data:
+                            partial_line += decoder.decode(data)
+                            data = os.read(stdout_fd, OUTPUT_READ_SIZE)
+                        break
+                    # no data, but we're still running
+                    if time.monotonic() - last_output_time >= timeout:
+                        # no output for too long, kill the job
+                        display.display_error(
+                            "startosinstall timeout after %d seconds"
+                            % timeout)
+                        job.stop()
+                        break
+                    # wait for more output or for the job to exit (or a
+                    # second, so we notice stop requests) before checking
+                    # again
+                    if kqueue:
+                        for event in kqueue.control(None, 2, 1):
+                            if event.filter == select.KQ_FILTER_PROC:
+                                job_exited = True
+                    else:
+                        time.sleep(1)
+                    continue
+
+                # we got non-empty output, reset inactive timer
+                last_output_time = time.monotonic()
+                lines = (partial_line + decoder.decode(data)).split(u'\n')
+                # the last item is an incomplete line, or empty
+                partial_line = lines.pop()
+                for line in lines:
+                    yield line + u'\n'
+        finally:
+            if kqueue:
+                kqueue.close()
+
+        # remaining output is split in lines as above
+        partial_line += decoder.decode(b'', final=True)
+        lines = partial_line.split(u'\n')
+        partial_line = lines.pop()
+        for line in lines:
+            yield line + u'\n'
+        if partial_line:
+            yield partial_line
+
     def start(self):
         '''Starts a macOS install from an Install macOS.app stored at the root
         of a disk image, or from a locally installed Install macOS.app.
@@ -344,51 +523,25 @@ class StartOSInstallRunner(object):
         try:
             job = launchd.Job(cmd, environment_vars=env, cleanup_at_exit=False)
             job.start()
+            self.job_pid = job.info()['PID']
         except launchd.LaunchdJobException as err:
             display.display_error(
                 'Error with launchd job (%s): %s', cmd, err)
             display.display_error('Aborting startosinstall run.')
             raise StartOSInstallError(err)
 
-        startosinstall_output = []
+        startosinstall_output = collections.deque(maxlen=OUTPUT_TAIL_LINES)
         timeout = 2 * 60 * 60
-        inactive = 0
-        while True:
-            if processes.stop_requested():
-                job.stop()
-                break
-
-            info_output = job.stdout.readline()
-            if not info_output:
-                if job.returncode() is not None:
-                    break
-                else:
-                    # no data, but we're still running
-                    inactive += 1
-                    if inactive >= timeout:
-                        # no output for too long, kill the job
-                        display.display_error(
-                            "startosinstall timeout after %d seconds"
-                            % timeout)
-                        job.stop()
-                        break
-                    # sleep a bit before checking for more output
-                    time.sleep(1)
-                    continue
-
-            # we got non-empty output, reset inactive timer
-            inactive = 0
-
-            info_output = info_output.decode('UTF-8')
-            # save all startosinstall output in case there is
-            # an error so we can dump it to the log
-            startosinstall_output.append(info_output)
+        for info_output in self.read_output(job, timeout):
+            # save recent startosinstall output in case there is an error so
+            # we can dump it to the log
+            append_output_tail(startosinstall_output, info_output)
 
             # parse output for useful progress info
             msg = info_output.strip()
-            if msg.startswith('Preparing to '):
-                display.display_status_minor(msg)
-            elif msg.startswith(('Preparing ', 'Preparing: ')):
+            match = STARTOSINSTALL_MSG_RE.match(msg)
+            kind = match.lastgroup if match else None
+            if kind == 'percent':
                 # percent-complete messages
                 percent_str = msg.split()[-1].rstrip('%.')
                 try:
@@ -396,25 +549,22 @@ class StartOSInstallRunner(object):
                 except ValueError:
                     percent = -1
                 display.display_percent_done(percent, 100)
-            elif msg.startswith(('By using the agreetolicense option',
-                                 'If you do not agree,')):
+            elif kind == 'legalese':
                 # annoying legalese
                 pass
-            elif msg.startswith('Helper tool cr'):
+            elif kind == 'helper_crash':
                 # no need to print that stupid message to screen!
                 # 10.12: 'Helper tool creashed'
                 # 10.13: 'Helper tool crashed'
                 munkilog.log(msg)
-            elif msg.startswith(
-                    ('Signaling PID:', 'Waiting to reboot',
-                     'Process signaled okay')):
+            elif kind == 'signaling':
                 # messages around the SIGUSR1 signalling
                 display.display_debug1('startosinstall: %s', msg)
-            elif msg.startswith('System going down for install'):
+            elif kind == 'going_down':
                 display.display_status_minor(
                     'System will restart and begin upgrade of macOS.')
             else:
-                # none of the above, just display
+                # 'Preparing to ' or none of the above, just display
                 display.display_status_minor(msg)
 
         # startosinstall exited
@@ -428,7 +578,8 @@ class StartOSInstallRunner(object):
         if retcode and not (retcode == 255 and self.got_sigusr1):
             # append stderr to our startosinstall_output
             if job.stderr:
-                startosinstall_output.extend(job.stderr.read().splitlines())
+                for line in job.stderr.read().decode('UTF-8').splitlines():
+                    append_output_tail(startosinstall_output, line)
             display.display_status_minor(
                 "Starting macOS install failed with return code %s" % retcode)
             display.display_error("-"*78)
@@ -555,7 +706,7 @@ def run(finishing_tasks=None):
     cachedir = os.path.join(managedinstallbase, 'Cache')
     installinfopath = os.path.join(managedinstallbase, 'InstallInfo.plist')
     try:
-        installinfo = FoundationPlist.readPlist(installinfopath)
+        installinfo = read_plist(installinfopath)
     except FoundationPlist.NSPropertyListSerializationException:
         display.display_error("Invalid %s" % installinfopath)
         return False
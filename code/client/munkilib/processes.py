@@ -23,66 +23,271 @@ Functions for finding, listing, etc processes
 """
 from __future__ import absolute_import, print_function
 
+import collections
+import ctypes
 import os
+import pwd
+import re
 import signal
 import subprocess
+import time
 
 from .constants import LOGINWINDOW
 from . import display
 
 
-def get_running_processes():
-    """Returns a list of paths of running processes"""
-    proc = subprocess.Popen(['/bin/ps', '-axo' 'comm='],
-                            shell=False, stdin=subprocess.PIPE,
+# constants from <sys/proc_info.h> and <libproc.h>
+PROC_ALL_PIDS = 1
+PROC_PPID_ONLY = 6
+PROC_PIDT_SHORTBSDINFO = 13
+PROC_PIDPATHINFO_MAXSIZE = 4 * 1024
+MAXCOMLEN = 16
+
+
+# pylint: disable=too-few-public-methods
+class ProcBSDShortInfo(ctypes.Structure):
+    '''struct proc_bsdshortinfo from <sys/proc_info.h>. Unlike
+    PROC_PIDTBSDINFO, the kernel returns this for processes owned by other
+    users even when we aren't root'''
+    _fields_ = [
+        ('pbsi_pid', ctypes.c_uint32),
+        ('pbsi_ppid', ctypes.c_uint32),
+        ('pbsi_pgid', ctypes.c_uint32),
+        ('pbsi_status', ctypes.c_uint32),
+        ('pbsi_comm', ctypes.c_char * MAXCOMLEN),
+        ('pbsi_flags', ctypes.c_uint32),
+        ('pbsi_uid', ctypes.c_uint32),
+        ('pbsi_gid', ctypes.c_uint32),
+        ('pbsi_ruid', ctypes.c_uint32),
+        ('pbsi_rgid', ctypes.c_uint32),
+        ('pbsi_svuid', ctypes.c_uint32),
+        ('pbsi_svgid', ctypes.c_uint32),
+        ('pbsi_rfu', ctypes.c_uint32),
+    ]
+# pylint: enable=too-few-public-methods
+
+
+def _load_libproc():
+    '''Returns a ctypes handle to the libproc functions, or None if they
+    are not available'''
+    try:
+        # the libproc functions are exported by libSystem
+        libproc = ctypes.CDLL('/usr/lib/libc.dylib', use_errno=True)
+        # int proc_listpids(uint32_t type, uint32_t typeinfo,
+        #                   void *buffer, int buffersize)
+        libproc.proc_listpids.restype = ctypes.c_int
+        libproc.proc_listpids.argtypes = [
+            ctypes.c_uint32, ctypes.c_uint32, ctypes.c_void_p, ctypes.c_int]
+        # int proc_pidpath(int pid, void *buffer, uint32_t buffersize)
+        libproc.proc_pidpath.restype = ctypes.c_int
+        libproc.proc_pidpath.argtypes = [
+            ctypes.c_int, ctypes.c_void_p, ctypes.c_uint32]
+        # int proc_pidinfo(int pid, int flavor, uint64_t arg,
+        #                  void *buffer, int buffersize)
+        libproc.proc_pidinfo.restype = ctypes.c_int
+        libproc.proc_pidinfo.argtypes = [
+            ctypes.c_int, ctypes.c_int, ctypes.c_uint64,
+            ctypes.c_void_p, ctypes.c_int]
+    except (OSError, AttributeError):
+        return None
+    return libproc
+
+
+_LIBPROC = _load_libproc()
+
+
+def _libproc_list_pids(list_type=PROC_ALL_PIDS, typeinfo=0):
+    '''Returns a list of the pids of all processes (or those selected by
+    list_type and typeinfo), or None if they could not be listed'''
+    if _LIBPROC is None:
+        return None
+    pid_size = ctypes.sizeof(ctypes.c_int)
+    bufsize = _LIBPROC.proc_listpids(list_type, typeinfo, None, 0)
+    if bufsize < 0:
+        return None
+    # leave some room for processes started since the previous call
+    pid_buf = (ctypes.c_int * (bufsize // pid_size + 64))()
+    bufsize = _LIBPROC.proc_listpids(
+        list_type, typeinfo, pid_buf, ctypes.sizeof(pid_buf))
+    if bufsize < 0:
+        return None
+    return [pid for pid in pid_buf[:bufsize // pid_size] if pid > 0]
+
+
+def _libproc_pid_path(pid, path_buf):
+    '''Returns the executable path for pid, or None. path_buf is a
+    ctypes string buffer that is reused between calls'''
+    length = _LIBPROC.proc_pidpath(pid, path_buf, ctypes.sizeof(path_buf))
+    if length <= 0:
+        return None
+    return path_buf.raw[:length].decode('UTF-8', 'replace')
+
+
+def _username_for_uid(uid):
+    '''Returns the username for uid, or the uid as a string if there is
+    no such user (as ps does)'''
+    if not hasattr(_username_for_uid, 'cache'):
+        _username_for_uid.cache = {}
+    if uid not in _username_for_uid.cache:
+        try:
+            _username_for_uid.cache[uid] = pwd.getpwuid(uid).pw_name
+        except KeyError:
+            _username_for_uid.cache[uid] = str(uid)
+    return _username_for_uid.cache[uid]
+
+
+def _libproc_running_processes():
+    """Returns a list of paths of running processes using libproc, or None
+    if libproc is not available"""
+    pids = _libproc_list_pids()
+    if pids is None:
+        return None
+    path_buf = ctypes.create_string_buffer(PROC_PIDPATHINFO_MAXSIZE)
+    proc_list = []
+    for pid in pids:
+        path = _libproc_pid_path(pid, path_buf)
+        if path and path.startswith('/'):
+            proc_list.append(path)
+    return proc_list
+
+
+def _ps_running_processes():
+    """Returns a list of paths of running processes using /bin/ps, or None
+    if ps fails"""
+    proc = subprocess.Popen(['/bin/ps', '-axo', 'comm='],
+                            shell=False, bufsize=-1, close_fds=True,
+                            stdin=subprocess.DEVNULL,
                             stdout=subprocess.PIPE,
                             stderr=subprocess.PIPE)
     output = proc.communicate()[0].decode('UTF-8')
-    if proc.returncode == 0:
-        proc_list = [item for item in output.splitlines()
-                     if item.startswith('/')]
-        launchcfmapp = ('/System/Library/Frameworks/Carbon.framework'
-                        '/Versions/A/Support/LaunchCFMApp')
-        if launchcfmapp in proc_list:
-            # we have a really old Carbon app
-            proc = subprocess.Popen(['/bin/ps', '-axwwwo' 'args='],
-                                    shell=False, stdin=subprocess.PIPE,
-                                    stdout=subprocess.PIPE,
-                                    stderr=subprocess.PIPE)
-            output = proc.communicate()[0].decode('UTF-8')
-            if proc.returncode == 0:
-                carbon_apps = [item[len(launchcfmapp)+1:]
-                               for item in output.splitlines()
-                               if item.startswith(launchcfmapp)]
-                if carbon_apps:
-                    proc_list.extend(carbon_apps)
-        return proc_list
-    else:
-        return []
+    if proc.returncode != 0:
+        return None
+    return [item for item in output.splitlines()
+            if item.startswith('/')]
+
+
+# how long, in seconds, get_running_processes() may return a cached list
+PROCESS_CACHE_TTL = 1.0
+_PROCESS_CACHE = {'time': 0.0, 'list': None, 'index': None}
+
 
+def invalidate_process_cache():
+    """Forces the next call to get_running_processes() to get a fresh list
+    of running processes"""
+    _PROCESS_CACHE['time'] = 0.0
+    _PROCESS_CACHE['list'] = None
+    _PROCESS_CACHE['index'] = None
 
-def is_app_running(appname):
+
+def get_running_processes():
+    """Returns a list of paths of running processes. The list is cached for
+    PROCESS_CACHE_TTL seconds; callers must not modify it."""
+    now = time.monotonic()
+    if (_PROCESS_CACHE['list'] is not None and
+            now - _PROCESS_CACHE['time'] < PROCESS_CACHE_TTL):
+        return _PROCESS_CACHE['list']
+    _PROCESS_CACHE['list'] = _get_running_processes()
+    _PROCESS_CACHE['time'] = now
+    return _PROCESS_CACHE['list']
+
+
+def _get_running_processes():
+    """Returns a list of paths of running processes"""
+    proc_list = _libproc_running_processes()
+    if proc_list is None:
+        proc_list = _ps_running_processes()
+    if proc_list is None:
+        return []
+    launchcfmapp = ('/System/Library/Frameworks/Carbon.framework'
+                    '/Versions/A/Support/LaunchCFMApp')
+    if launchcfmapp in proc_list:
+        # we have a really old Carbon app
+        proc = subprocess.Popen(['/bin/ps', '-axwwwo', 'args='],
+                                shell=False, bufsize=-1, close_fds=True,
+                                stdin=subprocess.DEVNULL,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE)
+        output = proc.communicate()[0].decode('UTF-8')
+        if proc.returncode == 0:
+            carbon_apps = [item[len(launchcfmapp)+1:]
+                           for item in output.splitlines()
+                           if item.startswith(launchcfmapp)]
+            if carbon_apps:
+                proc_list.extend(carbon_apps)
+    return proc_list
+
+
+class ProcessIndex(object):
+    """Lookup tables built from a list of running process paths so that
+    many appnames can be checked against the same list cheaply"""
+
+    def __init__(self, proc_list):
+        self.proc_list = proc_list
+        # one substring search over all the paths rules out most appnames
+        # before we fall back to a per-item scan
+        self.all_paths = '\n'.join(proc_list)
+        self.exact = set(proc_list)
+        self.by_basename = collections.defaultdict(list)
+        self.app_bundle_paths = []
+        for item in proc_list:
+            self.by_basename[item.rsplit('/', 1)[-1]].append(item)
+            if '.app/Contents/MacOS/' in item:
+                self.app_bundle_paths.append(item)
+
+    def _app_bundle_matches(self, app_contents):
+        """Returns app bundle executables whose path contains
+        app_contents"""
+        if app_contents not in self.all_paths:
+            return []
+        return [item for item in self.app_bundle_paths
+                if app_contents in item]
+
+    def matching_items(self, appname):
+        """Returns the list of running processes that match appname"""
+        if appname.startswith('/'):
+            # search by exact path
+            if appname in self.exact:
+                return [appname]
+            return []
+        if appname.endswith('.app'):
+            # search by filename
+            return self._app_bundle_matches(
+                '/' + appname + '/Contents/MacOS/')
+        # check executable name
+        if '/' in appname:
+            # partial path; can't use the basename lookup
+            exe_suffix = '/' + appname
+            matching_items = []
+            if exe_suffix in self.all_paths:
+                matching_items = [item for item in self.proc_list
+                                  if item.endswith(exe_suffix)]
+        else:
+            matching_items = list(self.by_basename.get(appname, []))
+        if not matching_items:
+            # try adding '.app' to the name and check again
+            matching_items = self._app_bundle_matches(
+                '/' + appname + '.app/Contents/MacOS/')
+        return matching_items
+
+
+def _get_process_index(proc_list):
+    """Returns a ProcessIndex for proc_list, reusing the last one built if
+    it was built from the same list"""
+    index = _PROCESS_CACHE['index']
+    if index is None or index.proc_list is not proc_list:
+        index = ProcessIndex(proc_list)
+        _PROCESS_CACHE['index'] = index
+    return index
+
+
+def is_app_running(appname, proc_list=None):
     """Tries to determine if the application in appname is currently
-    running"""
+    running. If proc_list is given, it is used instead of getting a fresh
+    list of running processes."""
     display.display_detail('Checking if %s is running...' % appname)
-    proc_list = get_running_processes()
-    matching_items = []
-    if appname.startswith('/'):
-        # search by exact path
-        matching_items = [item for item in proc_list
-                          if item == appname]
-    elif appname.endswith('.app'):
-        # search by filename
-        matching_items = [item for item in proc_list
-                          if '/'+ appname + '/Contents/MacOS/' in item]
-    else:
-        # check executable name
-        matching_items = [item for item in proc_list
-                          if item.endswith('/' + appname)]
-    if not matching_items:
-        # try adding '.app' to the name and check again
-        matching_items = [item for item in proc_list
-                          if '/'+ appname + '.app/Contents/MacOS/' in item]
+    if proc_list is None:
+        proc_list = get_running_processes()
+    matching_items = _get_process_index(proc_list).matching_items(appname)
 
     if matching_items:
         # it's running!
@@ -109,16 +314,56 @@ def blocking_applications_running(pkginfoitem):
                     if item.get('type') == 'application']
 
     display.display_debug1("Checking for %s" % appnames)
-    running_apps = [appname for appname in appnames
-                    if is_app_running(appname)]
-    if running_apps:
-        display.display_detail(
-            "Blocking apps for %s are running:" % pkginfoitem['name'])
-        display.display_detail("    %s" % running_apps)
-        return True
+    if not appnames:
+        return False
+    # get a fresh process list once and check the appnames against it; a
+    # cached list may predate an install that just launched a blocking app.
+    # One running app is enough, so stop at the first one
+    invalidate_process_cache()
+    proc_list = get_running_processes()
+    for appname in appnames:
+        if is_app_running(appname, proc_list=proc_list):
+            display.display_detail(
+                "Blocking app for %s is running:" % pkginfoitem['name'])
+            display.display_detail("    %s" % appname)
+            return True
     return False
 
 
+def _libproc_find_processes(user=None, exe=None):
+    """Like find_processes, but uses libproc instead of ps. Returns None
+    if libproc is not available."""
+    pids = _libproc_list_pids()
+    if pids is None:
+        return None
+    bsdinfo = ProcBSDShortInfo()
+    bsdinfo_size = ctypes.sizeof(bsdinfo)
+    path_buf = ctypes.create_string_buffer(PROC_PIDPATHINFO_MAXSIZE)
+    found = {}
+    for pid in pids:
+        info_size = _LIBPROC.proc_pidinfo(
+            pid, PROC_PIDT_SHORTBSDINFO, 0, ctypes.byref(bsdinfo),
+            bsdinfo_size)
+        if info_size != bsdinfo_size:
+            # process went away or we can't get info about it
+            continue
+        p_comm = _libproc_pid_path(pid, path_buf)
+        if not p_comm:
+            p_comm = bsdinfo.pbsi_comm.decode('UTF-8', 'replace')
+        if exe is not None:
+            if not p_comm.startswith(exe):
+                continue
+        p_user = _username_for_uid(bsdinfo.pbsi_uid)
+        if user is not None:
+            if p_user != user:
+                continue
+        found[pid] = {
+            'user': p_user,
+            'exe': p_comm,
+        }
+    return found
+
+
 def find_processes(user=None, exe=None):
     """Find processes in process list.
 
@@ -135,38 +380,60 @@ def find_processes(user=None, exe=None):
 
         list of pids, or {} if none
     """
+    pids = _libproc_find_processes(user=user, exe=exe)
+    if pids is not None:
+        return pids
+
+    # fall back to ps
     argv = ['/bin/ps', '-x', '-w', '-w', '-a', '-o', 'pid=,user=,comm=']
     ps_proc = subprocess.Popen(
-        argv, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    stdout = ps_proc.communicate()[0].decode('UTF-8')
+        argv, bufsize=-1, close_fds=True, stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stdout = ps_proc.communicate()[0]
 
     pids = {}
 
     if not stdout or ps_proc.returncode != 0:
         return pids
 
-    try:
-        lines = stdout.splitlines()
-        for proc in lines:
-            (p_pid, p_user, p_comm) = proc.split(None, 2)
-
-            if exe is not None:
-                if not p_comm.startswith(exe):
-                    continue
-            if user is not None:
-                if p_user != user:
-                    continue
-            pids[int(p_pid)] = {
-                'user': p_user,
-                'exe': p_comm,
-            }
-
-    except (ValueError, TypeError, IndexError):
-        return pids
+    for match in _ps_line_regex(user=user, exe=exe).finditer(stdout):
+        pids[int(match.group('pid'))] = {
+            'user': match.group('user').decode('UTF-8'),
+            'exe': match.group('comm').decode('UTF-8'),
+        }
 
     return pids
 
 
+# matches a line of `ps -o pid=,user=,comm=` output
+PS_LINE_RE = re.compile(
+    br'^\s*(?P<pid>\d+)\s+(?P<user>\S+)\s+(?P<comm>.+)$', re.M)
+
+
+def _ps_line_regex(user=None, exe=None):
+    """Returns a compiled regex that matches the lines of
+    `ps -o pid=,user=,comm=` output for processes owned by user whose
+    executable starts with exe, so that other lines are skipped without
+    being parsed"""
+    if user is None and exe is None:
+        return PS_LINE_RE
+    user_pattern = br'\S+'
+    if user is not None:
+        user_pattern = re.escape(user.encode('UTF-8'))
+    comm_pattern = br'.+'
+    if exe is not None:
+        comm_pattern = re.escape(exe.encode('UTF-8')) + br'.*'
+    return re.compile(
+        br'^\s*(?P<pid>\d+)\s+(?P<user>' + user_pattern + br')\s+'
+        br'(?P<comm>' + comm_pattern + br')$', re.M)
+
+
+def get_child_pids(ppid):
+    """Returns a list of the pids of the child processes of ppid, or None
+    if they can't be determined"""
+    return _libproc_list_pids(PROC_PPID_ONLY, ppid)
+
+
 def force_logout_now():
     """Force the logout of interactive GUI users and spawn MSU."""
     try:
@@ -179,8 +446,8 @@ def force_logout_now():
             del users['root']
 
         # force MSU GUI to raise
-        fileref = open('/private/tmp/com.googlecode.munki.installatlogout', 'w')
-        fileref.close()
+        os.close(os.open('/private/tmp/com.googlecode.munki.installatlogout',
+                         os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644))
 
         # kill loginwindows to cause logout of current users, whether
         # active or switched away via fast user switching.
@@ -189,6 +456,8 @@ def force_logout_now():
                 os.kill(users[user], signal.SIGKILL)
             except OSError:
                 pass
+        # the process list has changed out from under us
+        invalidate_process_cache()
 
     except BaseException as err:
         display.display_error('Exception in force_logout_now(): %s' % str(err))
@@ -0,0 +1,64 @@
+#!/usr/bin/python
+# encoding: utf-8
+"""
+test_appendoutputtail.py
+
+Unit tests for osinstaller.append_output_tail.
+
+"""
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import, print_function
+
+import collections
+import unittest
+
+from munkilib import osinstaller
+
+
+try:
+    from mock import patch
+except ImportError:
+    import sys
+    print("mock module is required. run: easy_install mock", file=sys.stderr)
+    raise
+
+
+class TestAppendOutputTail(unittest.TestCase):
+    """Test that lines dropped from the output tail are logged."""
+
+    @patch('munkilib.osinstaller.munkilog.log')
+    def test_no_logging_until_full(self, log_mock):
+        output_tail = collections.deque(maxlen=3)
+        for line in ['one\n', 'two\n', 'three\n']:
+            osinstaller.append_output_tail(output_tail, line)
+        self.assertEqual(list(output_tail), ['one\n', 'two\n', 'three\n'])
+        self.assertEqual(log_mock.call_count, 0)
+
+    @patch('munkilib.osinstaller.munkilog.log')
+    def test_dropped_lines_are_logged(self, log_mock):
+        output_tail = collections.deque(maxlen=2)
+        # stdout lines have newlines, stderr lines from splitlines() don't
+        for line in ['one\n', 'two\n', 'err one', 'err two']:
+            osinstaller.append_output_tail(output_tail, line)
+        self.assertEqual(list(output_tail), ['err one', 'err two'])
+        self.assertEqual(
+            [call[0][0] for call in log_mock.call_args_list],
+            ['startosinstall: one', 'startosinstall: two'])
+
+
+def main():
+    unittest.main(buffer=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+#!/usr/bin/python
+# encoding: utf-8
+"""
+test_readoutput.py
+
+Unit tests for osinstaller.StartOSInstallRunner.read_output.
+
+"""
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import, print_function
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from munkilib import osinstaller
+
+
+try:
+    from mock import patch
+except ImportError:
+    import sys
+    print("mock module is required. run: easy_install mock", file=sys.stderr)
+    raise
+
+
+class FakeJob(object):
+    """Stands in for a launchd.Job. Each time read_output sleeps waiting for
+    output, the next chunk is written to the stdout file; once there are no
+    chunks left, the job exits (unless never_exits is set)."""
+
+    def __init__(self, stdout_path, chunks, exit_output=b'',
+                 never_exits=False):
+        self.stdout_path = stdout_path
+        open(stdout_path, 'wb').close()
+        self.stdout = open(stdout_path, 'rb')
+        self.chunks = list(chunks)
+        self.exit_output = exit_output
+        self.never_exits = never_exits
+        self.exited = False
+        self.stopped = False
+        self.clock = 0.0
+
+    def write(self, data):
+        with open(self.stdout_path, 'ab') as fileobj:
+            fileobj.write(data)
+
+    def sleep(self, seconds):
+        self.clock += seconds
+        if self.chunks:
+            self.write(self.chunks.pop(0))
+        elif not self.never_exits:
+            self.exited = True
+
+    def monotonic(self):
+        return self.clock
+
+    def returncode(self):
+        if self.exited:
+            if self.exit_output:
+                # written just as the process exits
+                self.write(self.exit_output)
+                self.exit_output = b''
+            return 0
+        return None
+
+    def stop(self):
+        self.stopped = True
+
+
+class TestReadOutput(unittest.TestCase):
+    """Test read_output without kqueue, so it sleeps between checks."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.stdout_path = os.path.join(self.tmpdir, 'stdout')
+        self.runner = osinstaller.StartOSInstallRunner('Install macOS.dmg')
+        patchers = [
+            patch('munkilib.osinstaller.select.kqueue',
+                  side_effect=OSError, create=True),
+            patch('munkilib.osinstaller.processes.stop_requested',
+                  return_value=False),
+            patch('munkilib.osinstaller.display.display_error'),
+        ]
+        self.mocks = [patcher.start() for patcher in patchers]
+        for patcher in patchers:
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def read_all(self, job, timeout=60):
+        with patch('munkilib.osinstaller.time.sleep', side_effect=job.sleep):
+            with patch('munkilib.osinstaller.time.monotonic',
+                       side_effect=job.monotonic):
+                lines = list(self.runner.read_output(job, timeout))
+        job.stdout.close()
+        return lines
+
+    def test_lines_split_across_reads(self):
+        job = FakeJob(self.stdout_path,
+                      [b'Preparing to run\nPrepar', b'ing 10.0%\n'])
+        self.assertEqual(self.read_all(job),
+                         ['Preparing to run\n', 'Preparing 10.0%\n'])
+
+    def test_trailing_line_without_newline(self):
+        job = FakeJob(self.stdout_path, [b'one\ntwo'])
+        self.assertEqual(self.read_all(job), ['one\n', 'two'])
+
+    def test_output_drained_after_exit(self):
+        job = FakeJob(self.stdout_path, [b'one\n'],
+                      exit_output=b'last words\nno newline')
+        self.assertEqual(self.read_all(job),
+                         ['one\n', 'last words\n', 'no newline'])
+        self.assertFalse(job.stopped)
+
+    def test_multibyte_character_split_across_reads(self):
+        data = u'héllo\n'.encode('UTF-8')
+        job = FakeJob(self.stdout_path, [data[:2], data[2:]])
+        self.assertEqual(self.read_all(job), [u'héllo\n'])
+
+    def test_inactivity_timeout(self):
+        job = FakeJob(self.stdout_path, [b'one\n'], never_exits=True)
+        self.assertEqual(self.read_all(job, timeout=5), ['one\n'])
+        self.assertTrue(job.stopped)
+        self.assertTrue(job.clock >= 5)
+        display_error = self.mocks[2]
+        self.assertEqual(display_error.call_count, 1)
+
+    def test_stop_requested(self):
+        job = FakeJob(self.stdout_path, [b'one\n', b'two\n'],
+                      never_exits=True)
+        stop_requested = self.mocks[1]
+        stop_requested.side_effect = [False, False, True]
+        # first pass finds no output and sleeps, which writes 'one';
+        # second pass reads it; third pass sees the stop request
+        self.assertEqual(self.read_all(job), ['one\n'])
+        self.assertTrue(job.stopped)
+
+
+def main():
+    unittest.main(buffer=True)
+
+
+if __name__ == '__main__':
+    main()
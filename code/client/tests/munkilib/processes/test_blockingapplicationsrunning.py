@@ -0,0 +1,105 @@
+#!/usr/bin/python
+# encoding: utf-8
+"""
+test_blockingapplicationsrunning.py
+
+Unit tests for processes.blocking_applications_running.
+
+"""
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import, print_function
+
+import unittest
+
+from ..data_scaffolds import getRunningProcessesMock
+from munkilib import processes
+
+
+try:
+    from mock import patch
+except ImportError:
+    import sys
+    print("mock module is required. run: easy_install mock", file=sys.stderr)
+    raise
+
+
+class TestBlockingApplicationsRunning(unittest.TestCase):
+    """Test processes.blocking_applications_running."""
+
+    @patch('munkilib.processes.get_running_processes',
+           return_value=getRunningProcessesMock())
+    def test_blocking_app_running(self, ps_mock):
+        item = {'name': 'Firefox',
+                'blocking_applications': ['BonziBUDDY.app', 'Firefox.app']}
+        self.assertEqual(
+            processes.blocking_applications_running(item), True)
+
+    @patch('munkilib.processes.get_running_processes',
+           return_value=getRunningProcessesMock())
+    def test_blocking_app_not_running(self, ps_mock):
+        item = {'name': 'BonziBUDDY',
+                'blocking_applications': ['BonziBUDDY.app', 'bonzi']}
+        self.assertEqual(
+            processes.blocking_applications_running(item), False)
+
+    @patch('munkilib.processes.get_running_processes',
+           return_value=getRunningProcessesMock())
+    def test_installs_app_running(self, ps_mock):
+        item = {'name': 'Firefox',
+                'installs': [{'type': 'application',
+                              'path': '/Applications/Firefox.app'}]}
+        self.assertEqual(
+            processes.blocking_applications_running(item), True)
+
+    @patch('munkilib.processes.get_running_processes',
+           return_value=getRunningProcessesMock())
+    def test_process_list_fetched_once(self, ps_mock):
+        item = {'name': 'BonziBUDDY',
+                'blocking_applications': ['BonziBUDDY.app', 'bonzi',
+                                          '/usr/local/bin/bonzi']}
+        processes.blocking_applications_running(item)
+        self.assertEqual(ps_mock.call_count, 1)
+
+    @patch('munkilib.processes.is_app_running', return_value=True)
+    def test_stops_at_first_running_app(self, running_mock):
+        item = {'name': 'Firefox',
+                'blocking_applications': ['Firefox.app', 'firefox']}
+        with patch('munkilib.processes.get_running_processes',
+                   return_value=getRunningProcessesMock()):
+            self.assertEqual(
+                processes.blocking_applications_running(item), True)
+        self.assertEqual(running_mock.call_count, 1)
+
+    def test_fresh_process_list_after_install(self):
+        item = {'name': 'Firefox',
+                'blocking_applications': ['Firefox.app']}
+        before_install = [path for path in getRunningProcessesMock()
+                          if 'Firefox' not in path]
+        after_install = getRunningProcessesMock()
+        with patch('munkilib.processes._get_running_processes',
+                   side_effect=[before_install, after_install]) as ps_mock:
+            self.assertEqual(
+                processes.blocking_applications_running(item), False)
+            # an install here launches Firefox well within the cache TTL
+            self.assertEqual(
+                processes.blocking_applications_running(item), True)
+        self.assertEqual(ps_mock.call_count, 2)
+        processes.invalidate_process_cache()
+
+
+def main():
+    unittest.main(buffer=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+#!/usr/bin/python
+# encoding: utf-8
+"""
+test_findprocesses.py
+
+Unit tests for processes.find_processes when it falls back to ps.
+
+"""
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import, print_function
+
+import unittest
+
+from munkilib import processes
+
+
+try:
+    from mock import patch, MagicMock
+except ImportError:
+    import sys
+    print("mock module is required. run: easy_install mock", file=sys.stderr)
+    raise
+
+
+LOGINWINDOW = (
+    '/System/Library/CoreServices/loginwindow.app/Contents/MacOS/loginwindow')
+MSC = ('/Applications/Managed Software Center.app/Contents/MacOS/'
+       'Managed Software Center')
+
+PS_OUTPUT = (
+    u'    1 root             /sbin/launchd\n'
+    u'   98 root             %s\n'
+    u'  120 rootx            %s\n'
+    u'  121 rootx            /usr/libexec/rootx-helper\n'
+    u'  402 bob              %s\n'
+    u'  403 bob              %s  \n'
+    u'  404 bobby            %s\n'
+    u'  405 _spotlight       /System/Library/Frameworks/CoreServices.framework/mds\n'
+    u'  406 bob              /Applications/Some App.app/Contents/MacOS/Some App\n'
+    % (LOGINWINDOW, LOGINWINDOW, LOGINWINDOW, MSC, MSC)).encode('UTF-8')
+
+
+def old_find_processes(stdout, user=None, exe=None):
+    """The split-based parser find_processes used before it used a regex"""
+    pids = {}
+    for proc in stdout.decode('UTF-8').splitlines():
+        (p_pid, p_user, p_comm) = proc.split(None, 2)
+        if exe is not None:
+            if not p_comm.startswith(exe):
+                continue
+        if user is not None:
+            if p_user != user:
+                continue
+        pids[int(p_pid)] = {
+            'user': p_user,
+            'exe': p_comm,
+        }
+    return pids
+
+
+def ps_mock(stdout):
+    """Returns a mock subprocess.Popen that outputs stdout"""
+    proc = MagicMock()
+    proc.communicate.return_value = (stdout, b'')
+    proc.returncode = 0
+    return MagicMock(return_value=proc)
+
+
+class TestFindProcessesPsFallback(unittest.TestCase):
+    """Test that find_processes parses ps output the same way the old
+    split(None, 2) parser did."""
+
+    def check(self, user=None, exe=None):
+        with patch('munkilib.processes._libproc_find_processes',
+                   return_value=None):
+            with patch('munkilib.processes.subprocess.Popen',
+                       ps_mock(PS_OUTPUT)):
+                found = processes.find_processes(user=user, exe=exe)
+        self.assertEqual(found, old_find_processes(PS_OUTPUT, user, exe))
+        return found
+
+    def test_no_filter(self):
+        self.assertEqual(len(self.check()), 9)
+
+    def test_user_is_not_a_prefix_match(self):
+        self.assertEqual(sorted(self.check(user='root')), [1, 98])
+        self.assertEqual(sorted(self.check(user='rootx')), [120, 121])
+        self.assertEqual(sorted(self.check(user='bob')), [402, 403, 406])
+
+    def test_user_with_regex_characters(self):
+        self.assertEqual(self.check(user='_spotlight')[405]['user'],
+                         '_spotlight')
+        self.assertEqual(self.check(user='b.b'), {})
+
+    def test_exe_prefix(self):
+        self.assertEqual(sorted(self.check(exe=LOGINWINDOW)), [98, 120, 402])
+        self.assertEqual(
+            sorted(self.check(exe='/Applications/Managed Software Center.app')),
+            [403, 404])
+        self.assertEqual(self.check(exe='/Applications/Some App.app'),
+                         {406: {'user': 'bob', 'exe': (
+                             '/Applications/Some App.app/Contents/MacOS/'
+                             'Some App')}})
+
+    def test_user_and_exe(self):
+        self.assertEqual(sorted(self.check(user='rootx', exe=LOGINWINDOW)),
+                         [120])
+        self.assertEqual(sorted(self.check(user='bobby', exe=LOGINWINDOW)),
+                         [])
+
+    def test_trailing_whitespace_kept(self):
+        self.assertEqual(self.check(user='bob', exe=MSC)[403]['exe'],
+                         MSC + '  ')
+
+    def test_ps_failure(self):
+        failed = ps_mock(b'')
+        failed.return_value.returncode = 1
+        with patch('munkilib.processes._libproc_find_processes',
+                   return_value=None):
+            with patch('munkilib.processes.subprocess.Popen', failed):
+                self.assertEqual(processes.find_processes(), {})
+
+
+def main():
+    unittest.main(buffer=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+#!/usr/bin/python
+# encoding: utf-8
+"""
+test_getrunningprocesses.py
+
+Unit tests for processes.get_running_processes caching.
+
+"""
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import, print_function
+
+import unittest
+
+from ..data_scaffolds import getRunningProcessesMock
+from munkilib import processes
+
+
+try:
+    from mock import patch
+except ImportError:
+    import sys
+    print("mock module is required. run: easy_install mock", file=sys.stderr)
+    raise
+
+
+class TestGetRunningProcessesCache(unittest.TestCase):
+    """Test that get_running_processes caches its result."""
+
+    def setUp(self):
+        processes.invalidate_process_cache()
+
+    def tearDown(self):
+        processes.invalidate_process_cache()
+
+    @patch('munkilib.processes._get_running_processes',
+           return_value=getRunningProcessesMock())
+    def test_list_is_cached(self, ps_mock):
+        first = processes.get_running_processes()
+        second = processes.get_running_processes()
+        self.assertIs(first, second)
+        self.assertEqual(ps_mock.call_count, 1)
+
+    @patch('munkilib.processes._get_running_processes',
+           return_value=getRunningProcessesMock())
+    def test_invalidate_process_cache(self, ps_mock):
+        processes.get_running_processes()
+        processes.invalidate_process_cache()
+        processes.get_running_processes()
+        self.assertEqual(ps_mock.call_count, 2)
+
+    @patch('munkilib.processes.PROCESS_CACHE_TTL', 0)
+    @patch('munkilib.processes._get_running_processes',
+           return_value=getRunningProcessesMock())
+    def test_cache_expires(self, ps_mock):
+        processes.get_running_processes()
+        processes.get_running_processes()
+        self.assertEqual(ps_mock.call_count, 2)
+
+
+def main():
+    unittest.main(buffer=True)
+
+
+if __name__ == '__main__':
+    main()
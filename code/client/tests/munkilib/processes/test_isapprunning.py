@@ -45,7 +45,7 @@ class TestIsAppRunning(unittest.TestCase):
     def tearDown(self):
         self.processes = []
 
-    @patch('munkilib.processes.getRunningProcesses', return_value=getRunningProcessesMock())
+    @patch('munkilib.processes.get_running_processes', return_value=getRunningProcessesMock())
     def test_app_with_exact_path_match(self, ps_mock):
         print("Testing isAppRunning with exact path match...")
         self.assertEqual(
@@ -53,7 +53,7 @@ class TestIsAppRunning(unittest.TestCase):
             True
         )
 
-    @patch('munkilib.processes.getRunningProcesses', return_value=getRunningProcessesMock())
+    @patch('munkilib.processes.get_running_processes', return_value=getRunningProcessesMock())
     def test_app_with_exact_path_no_match(self, ps_mock):
         print("Testing isAppRunning with exact path no matches...")
         self.assertEqual(
@@ -61,7 +61,7 @@ class TestIsAppRunning(unittest.TestCase):
             False
         )
 
-    @patch('munkilib.processes.getRunningProcesses', return_value=getRunningProcessesMock())
+    @patch('munkilib.processes.get_running_processes', return_value=getRunningProcessesMock())
     def test_app_by_filename_match(self, ps_mock):
         print("Testing isAppRunning with file name match...")
         self.assertEqual(
@@ -69,7 +69,7 @@ class TestIsAppRunning(unittest.TestCase):
             True
         )
 
-    @patch('munkilib.processes.getRunningProcesses', return_value=getRunningProcessesMock())
+    @patch('munkilib.processes.get_running_processes', return_value=getRunningProcessesMock())
     def test_app_by_filename_no_match(self, ps_mock):
         print("Testing isAppRunning with file name no matches...")
         self.assertEqual(
@@ -77,7 +77,7 @@ class TestIsAppRunning(unittest.TestCase):
             False
         )
 
-    @patch('munkilib.processes.getRunningProcesses', return_value=getRunningProcessesMock())
+    @patch('munkilib.processes.get_running_processes', return_value=getRunningProcessesMock())
     def test_app_by_executable_name_match(self, ps_mock):
         print("Testing isAppRunning with executable name match...")
         self.assertEqual(
@@ -85,7 +85,7 @@ class TestIsAppRunning(unittest.TestCase):
             True
         )
 
-    @patch('munkilib.processes.getRunningProcesses', return_value=getRunningProcessesMock())
+    @patch('munkilib.processes.get_running_processes', return_value=getRunningProcessesMock())
     def test_app_by_executable_name_no_match(self, ps_mock):
         print("Testing isAppRunning with executable name no matches...")
         self.assertEqual(
@@ -93,7 +93,7 @@ class TestIsAppRunning(unittest.TestCase):
             False
         )
 
-    @patch('munkilib.processes.getRunningProcesses', return_value=getRunningProcessesMock())
+    @patch('munkilib.processes.get_running_processes', return_value=getRunningProcessesMock())
     def test_app_name_with_dot_app_match(self, ps_mock):
         print("Testing isAppRunning with name plus .app match...")
         self.assertEqual(
@@ -101,7 +101,7 @@ class TestIsAppRunning(unittest.TestCase):
             True
         )
 
-    @patch('munkilib.processes.getRunningProcesses', return_value=getRunningProcessesMock())
+    @patch('munkilib.processes.get_running_processes', return_value=getRunningProcessesMock())
     def test_app_name_with_dot_app_no_match(self, ps_mock):
         print("Testing isAppRunning with name plus .app match...")
         self.assertEqual(
@@ -109,6 +109,22 @@ class TestIsAppRunning(unittest.TestCase):
             False
         )
 
+    @patch('munkilib.processes.get_running_processes', return_value=getRunningProcessesMock())
+    def test_app_by_partial_path_match(self, ps_mock):
+        print("Testing isAppRunning with partial path match...")
+        self.assertEqual(
+            processes.is_app_running('Firefox.app/Contents/MacOS/firefox'),
+            True
+        )
+
+    @patch('munkilib.processes.get_running_processes', return_value=getRunningProcessesMock())
+    def test_app_by_partial_path_no_match(self, ps_mock):
+        print("Testing isAppRunning with partial path no matches...")
+        self.assertEqual(
+            processes.is_app_running('BonziBUDDY.app/Contents/MacOS/bonzi'),
+            False
+        )
+
 
 def main():
     unittest.main(buffer=True)